@@ -10,6 +10,7 @@ This example shows:
 5. Request-response pattern
 6. Clean disconnection
 """
+import logging
 import sys
 import time
 
@@ -35,14 +36,8 @@ def example_basic_connection():
     conn = Mqtt5Connection(transport=transport, client_id="pyqttier-example-1")
     
     # Wait for connection
-    timeout = 5
-    elapsed = 0
-    while not conn.is_connected() and elapsed < timeout:
-        print(f"⏳ Waiting for connection... ({elapsed}s/{timeout}s)")
-        time.sleep(0.5)
-        elapsed += 0.5
-    
-    if conn.is_connected():
+    print("⏳ Waiting for connection...")
+    if conn.wait_connected(timeout=5):
         print("✅ Connected to MQTT broker!")
         print(f"   Client ID: {conn.client_id}")
         print(f"   Online topic: {conn.online_topic}")
@@ -73,8 +68,9 @@ def example_publish():
     conn = Mqtt5Connection(transport=transport, client_id="pyqttier-example-2-publisher")
     
     # Wait for connection
-    while not conn.is_connected():
-        time.sleep(0.1)
+    if not conn.wait_connected(timeout=5):
+        print("❌ Failed to connect to broker")
+        return
     
     print("✅ Connected!")
     
@@ -109,8 +105,9 @@ def example_publish_subscribe():
     conn = Mqtt5Connection(transport=transport, client_id="pyqttier-example-2")
     
     # Wait for connection
-    while not conn.is_connected():
-        time.sleep(0.1)
+    if not conn.wait_connected(timeout=5):
+        print("❌ Failed to connect to broker")
+        return
     
     print("✅ Connected!")
     
@@ -165,8 +162,9 @@ def example_retained_messages():
     print("📡 First connection - publishing retained status...")
     conn1 = Mqtt5Connection(transport=transport, client_id="pyqttier-example-3a")
     
-    while not conn1.is_connected():
-        time.sleep(0.1)
+    if not conn1.wait_connected(timeout=5):
+        print("❌ Failed to connect to broker")
+        return
     
     # Publish a retained status message
     status_msg = Message(
@@ -187,8 +185,9 @@ def example_retained_messages():
     print("📡 Second connection - subscribing to status...")
     conn2 = Mqtt5Connection(transport=transport, client_id="pyqttier-example-3b")
     
-    while not conn2.is_connected():
-        time.sleep(0.1)
+    if not conn2.wait_connected(timeout=5):
+        print("❌ Failed to connect to broker")
+        return
     
     retained_received = []
     
@@ -228,8 +227,9 @@ def example_wildcard_subscriptions():
     
     conn = Mqtt5Connection(transport=transport, client_id="pyqttier-example-4")
     
-    while not conn.is_connected():
-        time.sleep(0.1)
+    if not conn.wait_connected(timeout=5):
+        print("❌ Failed to connect to broker")
+        return
     
     print("✅ Connected!")
     
@@ -283,8 +283,9 @@ def example_request_response():
     # Device that responds to commands
     device_conn = Mqtt5Connection(transport=transport, client_id="pyqttier-device")
     
-    while not device_conn.is_connected():
-        time.sleep(0.1)
+    if not device_conn.wait_connected(timeout=5):
+        print("❌ Failed to connect to broker")
+        return
     
     def on_command(msg: Message):
         command = msg.payload.decode()
@@ -311,8 +312,9 @@ def example_request_response():
     # Client that sends commands
     client_conn = Mqtt5Connection(transport=transport, client_id="pyqttier-client")
     
-    while not client_conn.is_connected():
-        time.sleep(0.1)
+    if not client_conn.wait_connected(timeout=5):
+        print("❌ Failed to connect to broker")
+        return
     
     responses = []
     
@@ -363,8 +365,9 @@ def example_multiple_callbacks():
     
     conn = Mqtt5Connection(transport=transport, client_id="pyqttier-example-6")
     
-    while not conn.is_connected():
-        time.sleep(0.1)
+    if not conn.wait_connected(timeout=5):
+        print("❌ Failed to connect to broker")
+        return
     
     print("✅ Connected!")
     
@@ -433,4 +436,5 @@ def main():
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     sys.exit(main())
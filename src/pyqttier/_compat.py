@@ -0,0 +1,5 @@
+import sys
+from typing import Any, Dict
+
+# ``@dataclass(slots=True)`` needs Python 3.10.  Older interpreters get regular ``__dict__`` backed instances.
+DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}  # type: Dict[str, Any]
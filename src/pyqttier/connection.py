@@ -1,34 +1,64 @@
-from concurrent.futures import Future
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
 import logging
+import os
 import threading
 import uuid
-from typing import Callable, Optional, Tuple, Any, Union, List, Dict
+from collections import deque
+from typing import Callable, Optional, Tuple, Any, Union, List, Dict, Deque, Iterable
 from paho.mqtt.client import Client as MqttClient, topic_matches_sub
 from paho.mqtt.enums import MQTTProtocolVersion, CallbackAPIVersion
 from paho.mqtt.properties import Properties as MqttProperties
 from paho.mqtt.packettypes import PacketTypes
-from queue import Queue, Empty
-from .interface import IBrokerConnection, MessageCallback
+from .interface import IBrokerConnection, MessageCallback, _gather_futures
 from .transport import MqttTransport, MqttTransportType
-from .message import Message
+from .message import Message, _copy_properties
 from .lwt import OnlinePresence
+from .matcher import TopicMatcher
+from ._compat import DATACLASS_SLOTS
 from dataclasses import dataclass
 
-logging.basicConfig(level=logging.DEBUG)
+# Marks a message ID whose publish completed before its future was registered.
+_PUBLISHED = object()
+
+# Publish futures are either concurrent.futures futures or, for publish_async(), asyncio futures.
+_PublishFuture = Union[Future, "asyncio.Future[None]"]
+
+
+def _complete_publish(fut: _PublishFuture) -> None:
+    if isinstance(fut, asyncio.Future):
+        # asyncio futures are not thread-safe, so resolve them on their event loop.
+        try:
+            fut.get_loop().call_soon_threadsafe(_set_async_publish_result, fut)
+        except RuntimeError:
+            pass  # The event loop has been closed.
+    else:
+        fut.set_result(None)
+
+
+def _set_async_publish_result(fut: "asyncio.Future[None]") -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+def _subscribe_properties(subscription_id: int) -> MqttProperties:
+    props = _copy_properties(PacketTypes.SUBSCRIBE)
+    props.SubscriptionIdentifier = subscription_id
+    return props
 
 
 class Mqtt5Connection(IBrokerConnection):
 
-    @dataclass
+    @dataclass(**DATACLASS_SLOTS)
     class PendingSubscription:
         topic: str
         subscription_id: int
         qos: int
 
-    @dataclass
+    @dataclass(**DATACLASS_SLOTS)
     class PendingPublish:
         msg: Message
-        future: Future
+        future: _PublishFuture
 
     def __init__(
         self,
@@ -36,33 +66,52 @@ class Mqtt5Connection(IBrokerConnection):
         client_id: Optional[str] = None,
         lwt: Optional[OnlinePresence] = None,
         credentials: Optional[Tuple[str, str]] = None,
+        concurrency: Optional[int] = None,
     ):
+        """
+        The ``concurrency`` argument sets how many worker threads run message callbacks.  Callbacks for the same
+        subscription always run on the same worker, so their ordering is preserved.  When not provided,
+        ``min(32, os.cpu_count() * 4)`` workers are used.  A value of 0 runs callbacks on paho's network thread.
+        """
         self._logger = logging.getLogger("MqttConnection")
         self._transport = transport
         self._client_id = client_id or str(uuid.uuid4())
         self._username = credentials[0] if credentials is not None else None
         self._password = credentials[1] if credentials is not None else None
-        self._queued_messages = Queue()  # type: Queue[Mqtt5Connection.PendingPublish]
+        # Guards the connected flag together with the pre-connect queues, so nothing is queued after they are drained.
+        self._connection_lock = threading.Lock()
+        self._queued_messages = deque()  # type: Deque[Mqtt5Connection.PendingPublish]
         self._queued_subscriptions = (
-            Queue()
-        )  # type: Queue[Mqtt5Connection.PendingSubscription]
+            deque()
+        )  # type: Deque[Mqtt5Connection.PendingSubscription]
         self._connected: bool = False
+        self._connected_event = threading.Event()
 
-        lwt_properties = MqttProperties(PacketTypes.PUBLISH)
-        lwt_properties.ContentType = "application/json"
-        lwt_properties.MessageExpiryInterval = 60 * 60 * 24  # 1 day
         self._lwt = lwt or OnlinePresence.default(self._client_id)
 
         self._connect_inner_mqtt_client()
 
         self._message_handling_lock = threading.RLock()
+        # Guards updates to the callback collections.  The callback dict and tuple are copy-on-write, so
+        # _on_message() can read them without taking the lock.
         with self._message_handling_lock:
             self._subscription_callbacks = dict()  # type: Dict[int, MessageCallback]
-            self._message_callbacks = []  # type: List[MessageCallback]
+            self._message_callbacks = tuple()  # type: Tuple[MessageCallback, ...]
+            # Used to route messages from brokers that do not echo back subscription identifiers.
+            self._subscription_filters = TopicMatcher()  # type: TopicMatcher[MessageCallback]
 
-        self._publishing_lock = threading.Lock()
-        with self._publishing_lock:
-            self._publish_futures = dict()  # type: Dict[int, Future]
+        if concurrency is None:
+            concurrency = min(32, (os.cpu_count() or 1) * 4)
+        self._dispatch_pools = [
+            ThreadPoolExecutor(max_workers=1) for _ in range(concurrency)
+        ]  # type: List[ThreadPoolExecutor]
+        self._general_dispatch_pool = (
+            ThreadPoolExecutor(max_workers=1) if concurrency > 0 else None
+        )  # type: Optional[ThreadPoolExecutor]
+
+        # Maps paho message IDs to publish futures.  Only the GIL-atomic setdefault() and pop() are used on it, see
+        # _track_publish() and on_publish_complete(), so no lock is needed.
+        self._publish_futures = dict()  # type: Dict[int, Any]
 
         self._client.loop_start()
         self._next_subscription_id = 10
@@ -81,7 +130,7 @@ class Mqtt5Connection(IBrokerConnection):
         self._client.on_connect = self._on_connect
         self._client.on_message = self._on_message
         self._client.on_publish = self.on_publish_complete
-        self._client.will_set(**self._lwt.online.paho_kwargs())
+        self._client.will_set(**self._lwt.offline.paho_kwargs())
         if self._username is not None:
             self._client.username_pw_set(self._username, self._password)
         if self._transport.tls_enabled and not self._transport.transport == MqttTransportType.UNIX:
@@ -97,9 +146,12 @@ class Mqtt5Connection(IBrokerConnection):
         self._client.connect(host, self._transport.port)
 
     def __del__(self):
-        if self._lwt is not None:
-            self._client.publish(**self._lwt.offline.paho_kwargs()).wait_for_publish()
+        self._lwt.offline.publish_via(self._client).wait_for_publish()
         self._client.disconnect()
+        for pool in self._dispatch_pools:
+            pool.shutdown(wait=False)
+        if self._general_dispatch_pool is not None:
+            self._general_dispatch_pool.shutdown(wait=False)
         self._client.loop_stop()
 
     @property
@@ -113,110 +165,182 @@ class Mqtt5Connection(IBrokerConnection):
     def is_connected(self) -> bool:
         return self._connected
 
+    def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until the connection to the broker is established or the timeout expires.  Returns True if connected."""
+        return self._connected_event.wait(timeout)
+
     def get_next_subscription_id(self) -> int:
-        sub_id = self._next_subscription_id
-        self._next_subscription_id += 1
+        with self._message_handling_lock:
+            sub_id = self._next_subscription_id
+            self._next_subscription_id += 1
         return sub_id
 
     def add_message_callback(self, callback: MessageCallback):
-        self._message_callbacks.append(callback)
+        with self._message_handling_lock:
+            self._message_callbacks = self._message_callbacks + (callback,)
+
+    def _run_callback(self, callback: MessageCallback, message: Message):
+        try:
+            callback(message)
+        except Exception:
+            self._logger.exception("Message callback for %s raised an exception", message.topic)
+
+    def _run_general_callbacks(self, callbacks: Tuple[MessageCallback, ...], message: Message):
+        for callback in callbacks:
+            self._run_callback(callback, message)
 
     def _on_message(self, client, userdata, msg):
-        self._logger.debug("Got a message to %s : %s", msg.topic, msg.payload.decode())
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("Got a message to %s : %r", msg.topic, msg.payload)
         message = Message.from_paho_message(msg)
+        callback = None  # type: Optional[MessageCallback]
         if len(message.subscription_ids) > 0:
+            subscription_callbacks = self._subscription_callbacks
             for sub_id in message.subscription_ids:
-                with self._message_handling_lock:
-                    if sub_id in self._subscription_callbacks:
-                        self._subscription_callbacks[sub_id](message)
-                        return
-                    else:
-                        self._logger.debug("No specific callback for subscription ID %d", sub_id)
-            else:
+                callback = subscription_callbacks.get(sub_id)
+                if callback is not None:
+                    break
+            if callback is None:
                 self._logger.debug("No matching subscription ID callbacks found for message.")
         else:
-            self._logger.warning("No subscription ID found in message properties. This is not usual because we always provide one when subscribing.")
-        with self._message_handling_lock:
-            for callback in self._message_callbacks:
-                callback(message)
+            self._logger.debug("No subscription ID in message properties, matching %s against the subscribed topics", message.topic)
+            with self._message_handling_lock:
+                match = min(self._subscription_filters.iter_match(message.topic), key=lambda m: m[0], default=None)
+            if match is not None:
+                sub_id, callback = match
+                message.subscription_ids = [sub_id]
+        if callback is not None:
+            if self._dispatch_pools:
+                pool = self._dispatch_pools[sub_id % len(self._dispatch_pools)]
+                pool.submit(self._run_callback, callback, message)
+            else:
+                self._run_callback(callback, message)
+            return
+        # Copy-on-write tuple, so no lock is needed to read it.
+        callbacks = self._message_callbacks
+        if self._general_dispatch_pool is not None:
+            self._general_dispatch_pool.submit(self._run_general_callbacks, callbacks, message)
+        else:
+            self._run_general_callbacks(callbacks, message)
 
     def _on_connect(self, client, userdata, flags, reason_code, properties):
         if reason_code == 0:  # Connection successful
-            self._connected = True
             self._logger.info(
                 "Connected to %s:%d", self._transport.host_or_path, self._transport.port
             )
-            while not self._queued_subscriptions.empty():
-                try:
-                    pending_subscr = self._queued_subscriptions.get_nowait()
-                except Empty:
-                    break
-                else:
+            with self._connection_lock:
+                self._connected = True
+                self._connected_event.set()
+                pending_subscriptions = self._queued_subscriptions
+                self._queued_subscriptions = deque()
+                pending_publishes = self._queued_messages
+                self._queued_messages = deque()
+                # Still holding the lock so that queued items go out before anything published concurrently.
+                for pending_subscr in pending_subscriptions:
                     self._logger.debug(
                         "Connected and subscribing to %s as subscription_id=%d", pending_subscr.topic, pending_subscr.subscription_id
                     )
-                    sub_props = MqttProperties(PacketTypes.SUBSCRIBE)
-                    sub_props.SubscriptionIdentifier = pending_subscr.subscription_id
+                    sub_props = _subscribe_properties(pending_subscr.subscription_id)
                     self._client.subscribe(
                         pending_subscr.topic, qos=pending_subscr.qos, properties=sub_props
                     )
-            while not self._queued_messages.empty():
-                try:
-                    msg = self._queued_messages.get_nowait()
-                except Empty:
-                    break
-                else:
+                for msg in pending_publishes:
                     self._logger.info(f"Publishing queued up message")
-                    pub_info = self._client.publish(**msg.msg.paho_kwargs())
-                    with self._publishing_lock:
-                        self._publish_futures[pub_info.mid] = msg.future
+                    pub_info = msg.msg.publish_via(self._client)
+                    self._track_publish(pub_info.mid, msg.future)
 
-            self._client.publish(**self._lwt.online.paho_kwargs())
+            pub_info = self._lwt.online.publish_via(self._client)
+            self._track_publish(pub_info.mid, Future())
         else:
             self._logger.error(
                 "Connection failed with reason code %s", str(reason_code)
             )
-            self._connected = False
+            with self._connection_lock:
+                self._connected = False
+                self._connected_event.clear()
 
     def on_publish_complete(
         self, client, userdata, mid, reason_code=None, properties=None
     ):
-        with self._publishing_lock:
-            if mid in self._publish_futures:
-                fut = self._publish_futures.pop(mid)
-                fut.set_result(None)
+        fut = self._publish_futures.pop(mid, None)
+        if fut is None or fut is _PUBLISHED:
+            # The publish has not been tracked yet.  Leave a marker for _track_publish(), unless it got there first.
+            fut = self._publish_futures.setdefault(mid, _PUBLISHED)
+            if fut is _PUBLISHED:
+                return
+            self._publish_futures.pop(mid, None)
+        _complete_publish(fut)
+
+    def _track_publish(self, mid: int, fut: _PublishFuture):
+        """Completes the future when paho reports the message with the provided ID as published."""
+        tracked = self._publish_futures.setdefault(mid, fut)
+        if tracked is not fut:
+            # paho reported the publish before we could register the future.
+            self._publish_futures.pop(mid, None)
+            _complete_publish(fut)
 
     def publish(self, message: Message) -> Future:
         """Publish a message to mqtt, or queue it if not connected yet.  Returns a Future that completes when the message is published."""
         fut = Future()  # type: Future
+        with self._connection_lock:
+            self._publish_locked(message, fut)
+        return fut
+
+    async def publish_async(self, message: Message) -> None:
+        """
+        Publishes a message and waits until it has been published.  This is the preferred API from asyncio code,
+        because the publish is tracked with a future of the running event loop.
+        """
+        fut = asyncio.get_running_loop().create_future()  # type: asyncio.Future[None]
+        with self._connection_lock:
+            self._publish_locked(message, fut)
+        await fut
+
+    def publish_many(self, messages: Iterable[Message]) -> Future:
+        """Publishes several messages while taking the connection lock only once.  Returns a Future that completes when all of them are published."""
+        # Consume the iterable first, it may call back into this connection.
+        messages = list(messages)
+        futures = []  # type: List[Future]
+        with self._connection_lock:
+            for message in messages:
+                fut = Future()  # type: Future
+                self._publish_locked(message, fut)
+                futures.append(fut)
+        return _gather_futures(futures)
+
+    def _publish_locked(self, message: Message, fut: _PublishFuture):
+        """Publishes or queues a message, completing the future once published.  The caller must hold the connection lock."""
         if self._connected:
             self._logger.info("Publishing %s", message.topic)
-            msg_info = self._client.publish(**message.paho_kwargs())
-            with self._publishing_lock:
-                self._publish_futures[msg_info.mid] = fut
+            msg_info = message.publish_via(self._client)
+            self._track_publish(msg_info.mid, fut)
         else:
             self._logger.info("Queueing %s for publishing later", message.topic)
             pending_pub = self.PendingPublish(msg=message, future=fut)
-            self._queued_messages.put(pending_pub)
-        return fut
+            self._queued_messages.append(pending_pub)
 
     def subscribe(self, topic: str, callback: Optional[MessageCallback] = None, qos: int = 1) -> int:
         """Subscribes to a topic. If the connection is not established, the subscription is queued.
         Returns the subscription ID.
         """
         sub_id = self.get_next_subscription_id()
-        if self._connected:
-            self._logger.debug("Subscribing to %s", topic)
-            sub_props = MqttProperties(PacketTypes.SUBSCRIBE)
-            sub_props.SubscriptionIdentifier = sub_id
-            self._client.subscribe(topic, qos=qos, properties=sub_props)
-        else:
-            self._logger.debug("Pending subscription to %s", topic)
-            self._queued_subscriptions.put(self.PendingSubscription(topic, sub_id, qos))
+        # Register the callback before subscribing so that retained messages are not missed.
         if callback is not None:
-            self._subscription_callbacks[sub_id] = callback
+            with self._message_handling_lock:
+                subscription_callbacks = dict(self._subscription_callbacks)
+                subscription_callbacks[sub_id] = callback
+                self._subscription_callbacks = subscription_callbacks
+                self._subscription_filters.add(topic, sub_id, callback)
         else:
             self._logger.warning("No callback provided for subscription to %s", topic)
+        with self._connection_lock:
+            if self._connected:
+                self._logger.debug("Subscribing to %s", topic)
+                sub_props = _subscribe_properties(sub_id)
+                self._client.subscribe(topic, qos=qos, properties=sub_props)
+            else:
+                self._logger.debug("Pending subscription to %s", topic)
+                self._queued_subscriptions.append(self.PendingSubscription(topic, sub_id, qos))
         return sub_id
 
     def is_topic_sub(self, topic: str, sub: str) -> bool:
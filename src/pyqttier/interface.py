@@ -1,11 +1,34 @@
 from abc import ABC, abstractmethod
-from typing import Callable, Dict, Any, Union, Optional
+from typing import Callable, Dict, Any, Union, Optional, Iterable, List
 from .message import Message
 from concurrent.futures import Future
+import asyncio
+import threading
 
 MessageCallback = Callable[[Message], None]
 
 
+def _gather_futures(futures: List[Future]) -> Future:
+    """Returns a Future that completes once all of the provided futures have completed."""
+    batch = Future()  # type: Future
+    if not futures:
+        batch.set_result(None)
+        return batch
+    lock = threading.Lock()
+    remaining = [len(futures)]
+
+    def on_done(_: Future) -> None:
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            batch.set_result(None)
+
+    for fut in futures:
+        fut.add_done_callback(on_done)
+    return batch
+
+
 class IBrokerConnection(ABC):
 
     @abstractmethod
@@ -16,6 +39,18 @@ class IBrokerConnection(ABC):
         """
         pass
 
+    async def publish_async(self, message: Message) -> None:
+        """
+        Publishes a message from asyncio code and waits until it has been published.
+        """
+        await asyncio.wrap_future(self.publish(message))
+
+    def publish_many(self, messages: Iterable[Message]) -> Future:
+        """
+        Publishes all of the provided messages.  Returns a single Future that completes when every message has been published.
+        """
+        return _gather_futures([self.publish(message) for message in messages])
+
     @abstractmethod
     def subscribe(self, topic: str, callback: Optional[MessageCallback] = None, qos: int = 1) -> int:
         """
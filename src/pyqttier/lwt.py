@@ -1,8 +1,9 @@
 
 from .message import Message
+from ._compat import DATACLASS_SLOTS
 from dataclasses import dataclass
 
-@dataclass
+@dataclass(frozen=True, **DATACLASS_SLOTS)
 class OnlinePresence:
     topic: str
     online: Message
@@ -0,0 +1,101 @@
+from functools import lru_cache
+from typing import Any, Dict, Generic, Iterator, List, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class TopicMatcher(Generic[V]):
+    """
+    Trie of MQTT topic filters, one node per topic level.  Matching a topic walks the trie level by level,
+    so its cost depends on the depth of the topic rather than on the number of stored filters.
+    Each filter may hold several values, keyed by an integer such as a subscription ID.
+    """
+
+    class _Node:
+        __slots__ = ("children", "values")
+
+        def __init__(self):
+            self.children = {}  # type: Dict[str, TopicMatcher._Node]
+            self.values = {}  # type: Dict[int, Any]
+
+    def __init__(self):
+        self._root = self._Node()
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, topic_filter: str, key: int, value: V) -> None:
+        """Stores a value for the provided topic filter under the provided key."""
+        node = self._root
+        for level in topic_filter.split("/"):
+            child = node.children.get(level)
+            if child is None:
+                child = self._Node()
+                node.children[level] = child
+            node = child
+        if key not in node.values:
+            self._count += 1
+        node.values[key] = value
+
+    def remove(self, topic_filter: str, key: int) -> bool:
+        """Removes the value stored for the topic filter under the key.  Returns False if there was none."""
+        path = []  # type: List[Tuple[TopicMatcher._Node, str]]
+        node = self._root
+        for level in topic_filter.split("/"):
+            child = node.children.get(level)
+            if child is None:
+                return False
+            path.append((node, level))
+            node = child
+        if key not in node.values:
+            return False
+        del node.values[key]
+        self._count -= 1
+        # Prune the nodes that no longer lead to any filter.
+        for parent, level in reversed(path):
+            child = parent.children[level]
+            if child.values or child.children:
+                break
+            del parent.children[level]
+        return True
+
+    def iter_match(self, topic: str) -> Iterator[Tuple[int, V]]:
+        """Yields the (key, value) pairs of every filter matching the provided topic, in no particular order."""
+        levels = topic.split("/")
+        depth = len(levels)
+        # Topics starting with '$' are not matched by filters starting with a wildcard.
+        skip_wildcards = topic.startswith("$")
+        stack = [(self._root, 0)]
+        while stack:
+            node, index = stack.pop()
+            children = node.children
+            if not skip_wildcards or index > 0:
+                multi = children.get("#")
+                if multi is not None:
+                    # '#' also matches the parent level, so 'a/#' matches 'a'.
+                    yield from multi.values.items()
+            if index == depth:
+                yield from node.values.items()
+                continue
+            if not skip_wildcards or index > 0:
+                single = children.get("+")
+                if single is not None:
+                    stack.append((single, index + 1))
+            exact = children.get(levels[index])
+            if exact is not None:
+                stack.append((exact, index + 1))
+
+
+@lru_cache(maxsize=4096)
+def _single_filter(topic_filter: str) -> "TopicMatcher[None]":
+    matcher = TopicMatcher()  # type: TopicMatcher[None]
+    matcher.add(topic_filter, 0, None)
+    return matcher
+
+
+def matches(topic: str, topic_filter: str) -> bool:
+    """Returns whether the topic matches the topic filter, following the same rules as TopicMatcher."""
+    for _ in _single_filter(topic_filter).iter_match(topic):
+        return True
+    return False
@@ -1,11 +1,32 @@
-from dataclasses import dataclass, field
-from typing import Optional, Dict, Any, List
-from paho.mqtt.client import MQTTMessage
+from copy import copy
+from dataclasses import dataclass, field, fields
+from operator import attrgetter
+from typing import Optional, Dict, Any, List, Tuple
+from paho.mqtt.client import MQTTMessage, MQTTMessageInfo, Client as MqttClient
 from paho.mqtt.properties import Properties as MqttProperties
 from paho.mqtt.packettypes import PacketTypes
+from ._compat import DATACLASS_SLOTS
 
-@dataclass
-class Message:
+# Building Properties walks paho's property tables, so new ones are copied from one template per packet type.
+_PROPERTIES_TEMPLATES = {}  # type: Dict[int, MqttProperties]
+
+
+def _copy_properties(packet_type: int) -> MqttProperties:
+    """Returns new, empty MQTT properties for the provided packet type."""
+    template = _PROPERTIES_TEMPLATES.get(packet_type)
+    if template is None:
+        template = _PROPERTIES_TEMPLATES[packet_type] = MqttProperties(packet_type)
+    return copy(template)
+
+
+class _MessageCache:
+    # Declared outside the dataclass so the cache is not a field and stays out of fields(), asdict() and astuple().
+    __slots__ = ("_cached_properties",)
+    _cached_properties: Tuple[Tuple[Any, ...], Optional[MqttProperties]]
+
+
+@dataclass(**DATACLASS_SLOTS)
+class Message(_MessageCache):
     topic: str
     payload: bytes
     qos: int
@@ -21,26 +42,77 @@ class Message:
         if self.user_properties is None:
             self.user_properties = dict()
 
+    def __copy__(self) -> "Message":
+        # Passing the fields directly is much faster than the generic copy protocol.  The cached properties are not copied.
+        cls = self.__class__
+        if cls is Message:
+            return Message(*_get_message_fields(self))
+        # Subclasses may add fields or their own constructor, so copy their state without calling __init__.
+        copied = cls.__new__(cls)
+        for f in fields(self):
+            setattr(copied, f.name, getattr(self, f.name))
+        state = getattr(self, "__dict__", None)
+        if state:
+            copied.__dict__.update(state)
+        return copied
+
     def paho_kwargs(self) -> Dict[str, Any]:
-        props = MqttProperties(PacketTypes.PUBLISH)
-        if self.content_type is not None:
-            props.ContentType = self.content_type
-        if self.correlation_data is not None:
-            props.CorrelationData = self.correlation_data
-        if self.response_topic is not None:
-            props.ResponseTopic = self.response_topic
-        if self.message_expiry_interval is not None:
-            props.MessageExpiryInterval = self.message_expiry_interval
-        if self.user_properties is not None and len(self.user_properties) > 0:
-            props.UserProperty = list(self.user_properties.items())
-        kwargs = {
+        """
+        Returns the keyword arguments for paho's ``Client.publish``.
+        """
+        return {
             "topic": self.topic,
             "payload": self.payload,
             "qos": self.qos,
             "retain": self.retain,
-            "properties": props,
+            "properties": self._paho_properties(),
         }
-        return kwargs
+
+    def publish_via(self, client: MqttClient) -> MQTTMessageInfo:
+        """
+        Publishes the message with the provided paho client, passing the arguments positionally rather than
+        unpacking ``paho_kwargs()``.
+        """
+        return client.publish(self.topic, self.payload, self.qos, self.retain, self._paho_properties())
+
+    def _paho_properties(self) -> Optional[MqttProperties]:
+        """
+        Returns the MQTT properties to publish with, or None if the message has none.  The properties are cached
+        together with the field values they were built from, and rebuilt if any of those fields has since changed.
+        """
+        user_properties = self.user_properties or None
+        source = (
+            self.content_type,
+            self.correlation_data,
+            self.response_topic,
+            self.message_expiry_interval,
+            user_properties,
+        )
+        cached = getattr(self, "_cached_properties", None)
+        if cached is not None and cached[0] == source:
+            return cached[1]
+        props = None  # type: Optional[MqttProperties]
+        if (
+            self.content_type is not None
+            or self.correlation_data is not None
+            or self.response_topic is not None
+            or self.message_expiry_interval is not None
+            or user_properties
+        ):
+            props = _copy_properties(PacketTypes.PUBLISH)
+            if self.content_type is not None:
+                props.ContentType = self.content_type
+            if self.correlation_data is not None:
+                props.CorrelationData = self.correlation_data
+            if self.response_topic is not None:
+                props.ResponseTopic = self.response_topic
+            if self.message_expiry_interval is not None:
+                props.MessageExpiryInterval = self.message_expiry_interval
+            if user_properties:
+                props.UserProperty = list(user_properties.items())
+        # Keep a copy of the user properties, so that changes made to the dict in place are noticed too.
+        self._cached_properties = (source[:4] + (dict(user_properties) if user_properties else None,), props)
+        return props
 
     @classmethod
     def from_paho_message(cls, paho_msg: MQTTMessage) -> "Message":
@@ -50,20 +122,28 @@ class Message:
             qos=paho_msg.qos,
             retain=paho_msg.retain,
         )
-        properties = (
-            paho_msg.properties.__dict__ if hasattr(paho_msg, "properties") else {}
-        )
-        if "UserProperty" in properties:
-            msg_obj.user_properties = dict(properties["UserProperty"])
-        if "ContentType" in properties:
-            msg_obj.content_type = properties["ContentType"]
-        if "CorrelationData" in properties:
-            msg_obj.correlation_data = properties["CorrelationData"]
-        if "ResponseTopic" in properties:
-            msg_obj.response_topic = properties["ResponseTopic"]
-        if "MessageExpiryInterval" in properties:
-            msg_obj.message_expiry_interval = properties["MessageExpiryInterval"]
-        if "SubscriptionIdentifier" in properties:
-            sub_ids = properties["SubscriptionIdentifier"] if isinstance(properties["SubscriptionIdentifier"], list) else [properties["SubscriptionIdentifier"]]
-            msg_obj.subscription_ids = sub_ids
+        props = getattr(paho_msg, "properties", None)
+        if props is not None:
+            user_properties = getattr(props, "UserProperty", None)
+            if user_properties is not None:
+                msg_obj.user_properties = dict(user_properties)
+            content_type = getattr(props, "ContentType", None)
+            if content_type is not None:
+                msg_obj.content_type = content_type
+            correlation_data = getattr(props, "CorrelationData", None)
+            if correlation_data is not None:
+                msg_obj.correlation_data = correlation_data
+            response_topic = getattr(props, "ResponseTopic", None)
+            if response_topic is not None:
+                msg_obj.response_topic = response_topic
+            message_expiry_interval = getattr(props, "MessageExpiryInterval", None)
+            if message_expiry_interval is not None:
+                msg_obj.message_expiry_interval = message_expiry_interval
+            sub_ids = getattr(props, "SubscriptionIdentifier", None)
+            if sub_ids is not None:
+                msg_obj.subscription_ids = sub_ids if isinstance(sub_ids, list) else [sub_ids]
         return msg_obj
+
+
+# Reads the fields of a Message in constructor order, used by Message.__copy__.
+_get_message_fields = attrgetter(*(f.name for f in fields(Message)))
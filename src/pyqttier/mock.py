@@ -1,26 +1,55 @@
-from concurrent.futures import Future
-from typing import Optional, Dict, List, Callable, Tuple
+from collections import deque
+from concurrent.futures import Executor, Future
+from functools import lru_cache
+from typing import Optional, Dict, List, Callable, Tuple, Deque, Iterable
 from copy import copy
 from .interface import IBrokerConnection, MessageCallback
+from .matcher import TopicMatcher, matches
 from .message import Message
 import threading
 import logging
 
+# Every mock publish completes immediately, so they can all share one resolved future.
+_RESOLVED = Future()  # type: Future
+_RESOLVED.set_result(None)
+
+# Upper bound on the number of topics whose dispatch target is remembered by a MockConnection.
+_TARGET_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=4096)
+def _match(topic: str, sub: str) -> bool:
+    """Returns whether the topic matches the topic filter.  Results are cached as the same pairs recur."""
+    if "+" not in sub and "#" not in sub:
+        return topic == sub
+    return matches(topic, sub)
+
+
 class MockConnection(IBrokerConnection):
     """
     Mock implementation of IBrokerConnection for testing purposes.
     Simulates broker behavior without requiring an actual MQTT broker.
+
+    If ``max_history`` is provided, only that many of the most recently published messages are kept.
+    If an ``executor`` is provided, simulated messages are delivered to callbacks through it instead of inline.
+    Messages are only delivered in order if the executor runs a single worker.
     """
 
-    def __init__(self):
+    def __init__(self, max_history: Optional[int] = None, executor: Optional[Executor] = None):
         self._connected = True
         self._subscriptions = (
             {}
         )  # type: Dict[int, Tuple[str, Optional[MessageCallback]]]
+        # Subscriptions with a callback, indexed by topic filter for dispatch.
+        self._subscription_filters = TopicMatcher()  # type: TopicMatcher[MessageCallback]
+        # Dispatch target of each recently simulated topic, None when no subscription callback matches.
+        self._topic_targets = {}  # type: Dict[str, Optional[Tuple[int, MessageCallback]]]
         self._message_callbacks = []  # type: List[MessageCallback]
-        self._published_messages = []  # type: List[Message]
+        self._published_messages = deque(maxlen=max_history)  # type: Deque[Message]
+        self._published_by_topic = {}  # type: Dict[str, Deque[Message]]
         self._next_subscription_id = 1  # type: int
-        self._lock = threading.RLock()
+        self._executor = executor
+        self._lock = threading.Lock()
         self._logger = logging.getLogger(self.__class__.__name__)
         self._logger.info("Initialized MockConnection")
 
@@ -36,12 +65,13 @@ class MockConnection(IBrokerConnection):
     def published_messages(self) -> List[Message]:
         """Returns list of all published messages for testing verification."""
         with self._lock:
-            return self._published_messages.copy()
+            return list(self._published_messages)
 
     def clear_published_messages(self) -> None:
         """Clears the list of published messages."""
         with self._lock:
             self._published_messages.clear()
+            self._published_by_topic.clear()
 
     def find_published(self, topic: str) -> List[Message]:
         """
@@ -53,8 +83,29 @@ class MockConnection(IBrokerConnection):
         Returns:
             List of messages that match the topic pattern
         """
+        if "+" not in topic and "#" not in topic:
+            with self._lock:
+                return list(self._published_by_topic.get(topic, ()))
         with self._lock:
-            return [msg for msg in self._published_messages if self.is_topic_sub(msg.topic, topic)]
+            # Match each distinct topic once, then keep the publish order with a set lookup per message.
+            matching_topics = {t for t in self._published_by_topic if matches(t, topic)}
+            return [msg for msg in self._published_messages if msg.topic in matching_topics]
+
+    def reset(self) -> None:
+        """
+        Returns the connection to its initial state: connected, with no subscriptions, callbacks or published messages.
+        The ``max_history`` and ``executor`` provided at construction are kept.
+        Helper method for testing.
+        """
+        with self._lock:
+            self._connected = True
+            self._subscriptions.clear()
+            self._subscription_filters = TopicMatcher()
+            self._topic_targets.clear()
+            self._message_callbacks.clear()
+            self._published_messages.clear()
+            self._published_by_topic.clear()
+            self._next_subscription_id = 1
 
     def set_connected(self, connected: bool) -> "MockConnection":
         """Sets the connection status for testing."""
@@ -62,26 +113,44 @@ class MockConnection(IBrokerConnection):
             self._connected = connected
         return self
 
-    def simulate_message(self, message: Message) -> None:
+    def simulate_message(self, message: Message) -> List[Future]:
         """
         Simulates receiving a message from the broker.
         Triggers appropriate callbacks based on subscriptions.
+        Returns the futures of the callbacks submitted to the executor, which is empty without an executor.
         """
         self._logger.debug("Simulating incoming message on topic: %s", message.topic)
+        # Callbacks run after the lock is released, so they may publish or subscribe.
         with self._lock:
-            # Check subscription-specific callbacks
-            for sub_id, (topic_filter, callback) in self._subscriptions.items():
-                if self.is_topic_sub(message.topic, topic_filter):
-                    if callback is not None:
-                        receiving_msg = copy(message)
-                        receiving_msg.subscription_ids = [sub_id]
-                        callback(receiving_msg)
-                        return
-
-            # If no specific callback matched, call general message callbacks
-            self._logger.debug("No subscription-specific callback matched, calling general callbacks")
-            for callback in self._message_callbacks:
+            # Check subscription-specific callbacks, the earliest subscription takes priority
+            try:
+                target = self._topic_targets[message.topic]
+            except KeyError:
+                target = min(
+                    self._subscription_filters.iter_match(message.topic), key=lambda m: m[0], default=None
+                )
+                if len(self._topic_targets) >= _TARGET_CACHE_SIZE:
+                    self._topic_targets.clear()
+                self._topic_targets[message.topic] = target
+            general_callbacks = list(self._message_callbacks)
+
+        if target is not None:
+            receiving_msg = copy(message)
+            receiving_msg.subscription_ids = [target[0]]
+            return self._deliver([target[1]], receiving_msg)
+
+        # If no specific callback matched, call general message callbacks
+        self._logger.debug("No subscription-specific callback matched, calling general callbacks")
+        return self._deliver(general_callbacks, message)
+
+    def _deliver(self, callbacks: List[MessageCallback], message: Message) -> List[Future]:
+        """Calls each callback with the message, or submits it to the executor if there is one."""
+        executor = self._executor
+        if executor is None:
+            for callback in callbacks:
                 callback(message)
+            return []
+        return [executor.submit(callback, message) for callback in callbacks]
 
     def publish(self, message: Message) -> Future:
         """
@@ -89,11 +158,34 @@ class MockConnection(IBrokerConnection):
         """
         self._logger.debug("Publishing message to topic: %s", message.topic)
         with self._lock:
-            self._published_messages.append(message)
+            self._record_locked(message)
+        return _RESOLVED
 
-        future: Future = Future()
-        future.set_result(None)
-        return future
+    def publish_many(self, messages: Iterable[Message]) -> Future:
+        """
+        Records all of the published messages under a single lock and returns a completed Future.
+        """
+        messages = list(messages)
+        self._logger.debug("Publishing %d messages", len(messages))
+        with self._lock:
+            for message in messages:
+                self._record_locked(message)
+        return _RESOLVED
+
+    def _record_locked(self, message: Message) -> None:
+        """Adds a message to the published history.  The caller must hold the lock."""
+        published = self._published_messages
+        if published.maxlen is not None and len(published) == published.maxlen:
+            if not published:
+                return  # max_history=0 keeps no messages at all
+            # The oldest message is about to be evicted, drop it from the topic index too.
+            oldest = published[0]
+            topic_messages = self._published_by_topic[oldest.topic]
+            topic_messages.popleft()
+            if not topic_messages:
+                del self._published_by_topic[oldest.topic]
+        published.append(message)
+        self._published_by_topic.setdefault(message.topic, deque()).append(message)
 
     def subscribe(self, topic: str, callback: Optional[MessageCallback] = None, qos: int = 1) -> int:
         """
@@ -104,6 +196,9 @@ class MockConnection(IBrokerConnection):
             sub_id = self._next_subscription_id
             self._next_subscription_id += 1
             self._subscriptions[sub_id] = (topic, callback)
+            if callback is not None:
+                self._subscription_filters.add(topic, sub_id, callback)
+                self._topic_targets.clear()
             return sub_id
 
     def add_message_callback(self, callback: MessageCallback) -> None:
@@ -118,27 +213,7 @@ class MockConnection(IBrokerConnection):
         Simple topic matching implementation.
         Supports MQTT wildcards: + (single level) and # (multi level).
         """
-        topic_parts = topic.split("/")
-        sub_parts = sub.split("/")
-
-        # # must be last and matches everything after
-        if "#" in sub_parts:
-            hash_idx = sub_parts.index("#")
-            if hash_idx != len(sub_parts) - 1:
-                return False  # # must be last
-            sub_parts = sub_parts[:hash_idx]
-            topic_parts = topic_parts[:hash_idx]
-
-        if len(topic_parts) != len(sub_parts):
-            return False
-
-        for topic_part, sub_part in zip(topic_parts, sub_parts):
-            if sub_part == "+":
-                continue  # + matches any single level
-            if topic_part != sub_part:
-                return False
-
-        return True
+        return _match(topic, sub)
 
     def is_connected(self) -> bool:
         """Returns the connection status."""
@@ -152,7 +227,9 @@ class MockConnection(IBrokerConnection):
         """
         with self._lock:
             if subscription_id in self._subscriptions:
-                del self._subscriptions[subscription_id]
+                topic, _ = self._subscriptions.pop(subscription_id)
+                if self._subscription_filters.remove(topic, subscription_id):
+                    self._topic_targets.clear()
 
     def get_subscription_count(self) -> int:
         """
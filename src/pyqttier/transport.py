@@ -3,7 +3,7 @@ from typing import Optional
 import ssl
 
 
-class MqttTransportType(Enum):
+class MqttTransportType(str, Enum):
     """Defines ways to connect to an MQTT broker."""
 
     TCP = "tcp"
@@ -1,4 +1,17 @@
+import asyncio
+import itertools
+import sys
 import unittest
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from copy import copy
+from dataclasses import asdict, dataclass, fields
+from unittest import mock
+from paho.mqtt.client import MQTTMessage
+from paho.mqtt.properties import Properties as MqttProperties
+from paho.mqtt.packettypes import PacketTypes
+from pyqttier.connection import Mqtt5Connection, _PUBLISHED
+from pyqttier.lwt import OnlinePresence
+from pyqttier.matcher import TopicMatcher, matches
 from pyqttier.message import Message
 from pyqttier.mock import MockConnection
 from pyqttier.transport import MqttTransport, MqttTransportType
@@ -8,9 +21,21 @@ import threading
 class TestMockConnection(unittest.TestCase):
     """Test MockConnection implementation."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create a mock connection and a worker pool shared by the tests."""
+        cls.shared_conn = MockConnection()
+        cls.pool = ThreadPoolExecutor(max_workers=5)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the worker threads used by the thread safety test."""
+        cls.pool.shutdown()
+
     def setUp(self):
-        """Create a fresh mock connection for each test."""
-        self.conn = MockConnection()
+        """Reset the shared mock connection for each test."""
+        self.conn = self.shared_conn
+        self.conn.reset()
 
     def test_initial_state(self):
         """Test initial connection state."""
@@ -43,6 +68,26 @@ class TestMockConnection(unittest.TestCase):
         self.assertEqual(len(published), 5)
         self.assertEqual(published[2].topic, "test/2")
 
+    def test_publish_many(self):
+        """Test publishing several messages at once."""
+        messages = [Message(topic=f"test/{i}", payload=b"test", qos=0) for i in range(3)]
+        future = self.conn.publish_many(messages)
+
+        self.assertTrue(future.done())
+        self.assertIsNone(future.result())
+        published = self.conn.published_messages
+        self.assertEqual([msg.topic for msg in published], ["test/0", "test/1", "test/2"])
+        self.assertEqual(self.conn.find_published("test/1"), [messages[1]])
+
+    def test_publish_async(self):
+        """Test publishing a message from asyncio code."""
+        msg = Message(topic="test/topic", payload=b"hello", qos=1)
+        asyncio.run(self.conn.publish_async(msg))
+
+        published = self.conn.published_messages
+        self.assertEqual(len(published), 1)
+        self.assertEqual(published[0].topic, "test/topic")
+
     def test_clear_published_messages(self):
         """Test clearing published messages."""
         msg = Message(topic="test", payload=b"test", qos=0)
@@ -52,6 +97,38 @@ class TestMockConnection(unittest.TestCase):
         self.conn.clear_published_messages()
         self.assertEqual(len(self.conn.published_messages), 0)
 
+    def test_find_published(self):
+        """Test finding published messages by exact topic and by wildcard."""
+        for topic in ["sensors/temp", "sensors/humidity", "other/temp", "sensors/temp"]:
+            self.conn.publish(Message(topic=topic, payload=b"data", qos=0))
+
+        self.assertEqual(len(self.conn.find_published("sensors/temp")), 2)
+        self.assertEqual(
+            [msg.topic for msg in self.conn.find_published("sensors/+")],
+            ["sensors/temp", "sensors/humidity", "sensors/temp"],
+        )
+        self.assertEqual(len(self.conn.find_published("+/temp")), 3)
+        self.assertEqual(len(self.conn.find_published("#")), 4)
+        self.assertEqual(self.conn.find_published("missing"), [])
+
+        self.conn.clear_published_messages()
+        self.assertEqual(self.conn.find_published("sensors/temp"), [])
+
+    def test_max_history(self):
+        """Test that only the most recent messages are kept when max_history is set."""
+        conn = MockConnection(max_history=3)
+        for i in range(5):
+            conn.publish(Message(topic=f"test/{i % 2}", payload=f"msg{i}".encode(), qos=0))
+
+        self.assertEqual([msg.payload for msg in conn.published_messages], [b"msg2", b"msg3", b"msg4"])
+        self.assertEqual([msg.payload for msg in conn.find_published("test/0")], [b"msg2", b"msg4"])
+        self.assertEqual([msg.payload for msg in conn.find_published("test/+")], [b"msg2", b"msg3", b"msg4"])
+
+        conn = MockConnection(max_history=0)
+        conn.publish(Message(topic="test/0", payload=b"msg0", qos=0))
+        self.assertEqual(conn.published_messages, [])
+        self.assertEqual(conn.find_published("test/0"), [])
+
     def test_subscribe_basic(self):
         """Test basic subscription."""
         sub_id = self.conn.subscribe("test/topic")
@@ -93,6 +170,18 @@ class TestMockConnection(unittest.TestCase):
         self.assertEqual(topic1_messages[0].payload, b"msg1")
         self.assertEqual(topic2_messages[0].payload, b"msg2")
 
+    def test_callback_can_publish(self):
+        """Test that a subscription callback can publish a response."""
+        def callback(msg: Message):
+            self.conn.publish(Message(topic="test/response", payload=msg.payload, qos=0))
+
+        self.conn.subscribe("test/request", callback)
+        self.conn.simulate_message(Message(topic="test/request", payload=b"ping", qos=0))
+
+        published = self.conn.published_messages
+        self.assertEqual(len(published), 1)
+        self.assertEqual(published[0].topic, "test/response")
+
     def test_add_message_callback(self):
         """Test adding a global message callback."""
         received_messages = []
@@ -126,6 +215,53 @@ class TestMockConnection(unittest.TestCase):
         self.assertEqual(len(subscription_messages), 1)
         self.assertEqual(len(global_messages), 0)
 
+    def test_wildcard_subscription_callback(self):
+        """Test that wildcard subscriptions receive matching messages and the earliest subscription wins."""
+        wildcard_messages = []
+        exact_messages = []
+
+        wildcard_id = self.conn.subscribe("sensors/#", lambda msg: wildcard_messages.append(msg))
+        self.conn.subscribe("sensors/temp", lambda msg: exact_messages.append(msg))
+
+        self.conn.simulate_message(Message(topic="sensors/temp", payload=b"20", qos=0))
+        self.conn.simulate_message(Message(topic="sensors/room/humidity", payload=b"40", qos=0))
+
+        self.assertEqual(len(wildcard_messages), 2)
+        self.assertEqual(wildcard_messages[0].subscription_ids, [wildcard_id])
+        self.assertEqual(len(exact_messages), 0)
+
+        self.conn.unsubscribe(wildcard_id)
+        self.conn.simulate_message(Message(topic="sensors/temp", payload=b"21", qos=0))
+        self.assertEqual(len(wildcard_messages), 2)
+        self.assertEqual(len(exact_messages), 1)
+
+    def test_subscribe_after_unmatched_message(self):
+        """Test that a new subscription receives topics that previously matched no subscription."""
+        global_messages = []
+        subscription_messages = []
+        self.conn.add_message_callback(lambda msg: global_messages.append(msg))
+
+        self.conn.simulate_message(Message(topic="late/topic", payload=b"1", qos=0))
+        self.conn.subscribe("late/+", lambda msg: subscription_messages.append(msg))
+        self.conn.simulate_message(Message(topic="late/topic", payload=b"2", qos=0))
+
+        self.assertEqual([msg.payload for msg in global_messages], [b"1"])
+        self.assertEqual([msg.payload for msg in subscription_messages], [b"2"])
+
+    def test_simulate_message_with_executor(self):
+        """Test that callbacks are run by the executor when one is provided."""
+        callback_threads = []
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            conn = MockConnection(executor=executor)
+            conn.subscribe("test/topic", lambda msg: callback_threads.append(threading.current_thread()))
+            futures = conn.simulate_message(Message(topic="test/topic", payload=b"test", qos=0))
+            wait(futures)
+
+        self.assertEqual(len(futures), 1)
+        self.assertEqual(len(callback_threads), 1)
+        self.assertIsNot(callback_threads[0], threading.current_thread())
+        self.assertEqual(self.conn.simulate_message(Message(topic="test/topic", payload=b"test", qos=0)), [])
+
     def test_is_topic_sub_exact_match(self):
         """Test exact topic matching."""
         self.assertTrue(self.conn.is_topic_sub("test/topic", "test/topic"))
@@ -145,6 +281,24 @@ class TestMockConnection(unittest.TestCase):
         self.assertTrue(self.conn.is_topic_sub("test/a/b/c", "test/#"))
         self.assertFalse(self.conn.is_topic_sub("other/topic", "test/#"))
 
+    def test_dollar_topics(self):
+        """Test that filters starting with a wildcard do not match topics starting with '$'."""
+        self.assertFalse(self.conn.is_topic_sub("$SYS/x", "#"))
+        self.assertFalse(self.conn.is_topic_sub("$SYS/x", "+/x"))
+        self.assertTrue(self.conn.is_topic_sub("$SYS/x", "$SYS/#"))
+
+        subscription_messages = []
+        global_messages = []
+        self.conn.subscribe("#", lambda msg: subscription_messages.append(msg))
+        self.conn.add_message_callback(lambda msg: global_messages.append(msg))
+        self.conn.simulate_message(Message(topic="$SYS/x", payload=b"test", qos=0))
+        self.assertEqual(len(subscription_messages), 0)
+        self.assertEqual(len(global_messages), 1)
+
+        self.conn.publish(Message(topic="$SYS/x", payload=b"test", qos=0))
+        self.assertEqual(self.conn.find_published("#"), [])
+        self.assertEqual(len(self.conn.find_published("$SYS/+")), 1)
+
     def test_set_connected(self):
         """Test changing connection status."""
         self.assertTrue(self.conn.is_connected())
@@ -163,6 +317,21 @@ class TestMockConnection(unittest.TestCase):
         self.conn.unsubscribe(sub_id)
         self.assertEqual(self.conn.get_subscription_count(), 0)
 
+    def test_reset(self):
+        """Test that reset returns the connection to its initial state."""
+        self.conn.subscribe("test/topic", lambda msg: None)
+        self.conn.add_message_callback(lambda msg: None)
+        self.conn.publish(Message(topic="test/topic", payload=b"test", qos=0))
+        self.conn.set_connected(False)
+
+        self.conn.reset()
+
+        self.assertTrue(self.conn.is_connected())
+        self.assertEqual(self.conn.get_subscription_count(), 0)
+        self.assertEqual(len(self.conn.published_messages), 0)
+        self.assertEqual(self.conn.find_published("test/topic"), [])
+        self.assertEqual(self.conn.subscribe("test/topic"), 1)
+
     def test_thread_safety(self):
         """Test thread safety of mock connection."""
         def publish_worker():
@@ -170,16 +339,225 @@ class TestMockConnection(unittest.TestCase):
                 msg = Message(topic=f"thread/test/{i}", payload=b"test", qos=0)
                 self.conn.publish(msg)
         
-        threads = [threading.Thread(target=publish_worker) for _ in range(5)]
-        for t in threads:
-            t.start()
-        for t in threads:
-            t.join()
-        
+        list(self.pool.map(lambda _: publish_worker(), range(5)))
+
         # Should have 50 messages total
         self.assertEqual(len(self.conn.published_messages), 50)
 
 
+class TestMessage(unittest.TestCase):
+    """Test Message class."""
+
+    def test_paho_kwargs_without_properties(self):
+        """Test that a message without MQTT5 properties does not build a Properties object."""
+        msg = Message(topic="test/topic", payload=b"hello", qos=1, retain=True)
+        kwargs = msg.paho_kwargs()
+        self.assertEqual(kwargs["topic"], "test/topic")
+        self.assertEqual(kwargs["payload"], b"hello")
+        self.assertEqual(kwargs["qos"], 1)
+        self.assertTrue(kwargs["retain"])
+        self.assertIsNone(kwargs["properties"])
+
+    def test_paho_kwargs_with_properties(self):
+        """Test that MQTT5 properties are passed through to paho."""
+        msg = Message(
+            topic="test/topic",
+            payload=b"hello",
+            qos=1,
+            content_type="application/json",
+            correlation_data=b"abc",
+            response_topic="test/response",
+            user_properties={"key": "value"},
+        )
+        props = msg.paho_kwargs()["properties"]
+        self.assertEqual(props.ContentType, "application/json")
+        self.assertEqual(props.CorrelationData, b"abc")
+        self.assertEqual(props.ResponseTopic, "test/response")
+        self.assertEqual(props.UserProperty, [("key", "value")])
+
+    def test_paho_kwargs_cached(self):
+        """Test that the MQTT properties are only built once, while the other arguments are read from the message."""
+        msg = Message(topic="test/topic", payload=b"hello", qos=1, content_type="text/plain")
+        kwargs = msg.paho_kwargs()
+        msg.payload = b"updated"
+
+        self.assertIs(msg.paho_kwargs()["properties"], kwargs["properties"])
+        self.assertEqual(msg.paho_kwargs()["payload"], b"updated")
+
+    def test_properties_follow_field_changes(self):
+        """Test that property fields changed after a publish are used on the next publish."""
+        msg = Message(topic="test/topic", payload=b"hello", qos=1, correlation_data=b"1", user_properties={"k": "1"})
+        msg.paho_kwargs()
+
+        msg.correlation_data = b"2"
+        self.assertEqual(msg.paho_kwargs()["properties"].CorrelationData, b"2")
+        msg.user_properties["k"] = "2"
+        self.assertEqual(msg.paho_kwargs()["properties"].UserProperty, [("k", "2")])
+        msg.correlation_data = None
+        msg.user_properties.clear()
+        self.assertIsNone(msg.paho_kwargs()["properties"])
+
+    def test_cache_is_not_a_field(self):
+        """Test that the paho kwargs cache does not show up in the dataclass fields."""
+        msg = Message(topic="test/topic", payload=b"hello", qos=1, correlation_data=b"1")
+        before = asdict(msg)
+        msg.paho_kwargs()
+
+        self.assertEqual(asdict(msg), before)
+        self.assertNotIn("_cached_properties", [f.name for f in fields(msg)])
+
+    def test_publish_via(self):
+        """Test that publish_via passes the same arguments as paho_kwargs positionally to the client."""
+        msg = Message(topic="test/topic", payload=b"hello", qos=1, retain=True, content_type="text/plain")
+        client = mock.Mock()
+        result = msg.publish_via(client)
+
+        self.assertIs(result, client.publish.return_value)
+        client.publish.assert_called_once_with(
+            "test/topic", b"hello", 1, True, msg.paho_kwargs()["properties"]
+        )
+
+    @unittest.skipIf(sys.version_info < (3, 10), "slotted dataclasses need Python 3.10")
+    def test_slots(self):
+        """Test that messages do not carry a per-instance __dict__ and still copy correctly."""
+        msg = Message(topic="test/topic", payload=b"hello", qos=1, user_properties={"key": "value"})
+        self.assertFalse(hasattr(msg, "__dict__"))
+
+        copied = copy(msg)
+        copied.subscription_ids = [1]
+        self.assertEqual(copied.topic, "test/topic")
+        self.assertEqual(copied.user_properties, {"key": "value"})
+        self.assertEqual(msg.subscription_ids, [])
+
+    def test_copy_subclass(self):
+        """Test that copying keeps the type and the extra state of Message subclasses."""
+        @dataclass
+        class TaggedMessage(Message):
+            tag: str = "default"
+
+        class CustomMessage(Message):
+            def __init__(self, topic: str):
+                super().__init__(topic=topic, payload=b"", qos=0)
+                self.extra = "value"
+
+        tagged = copy(TaggedMessage(topic="test/topic", payload=b"hello", qos=1, tag="custom"))
+        self.assertIsInstance(tagged, TaggedMessage)
+        self.assertEqual(tagged.tag, "custom")
+        self.assertEqual(tagged.payload, b"hello")
+
+        received = []
+        conn = MockConnection()
+        conn.subscribe("test/topic", lambda msg: received.append(msg))
+        conn.simulate_message(TaggedMessage(topic="test/topic", payload=b"hello", qos=1, tag="custom"))
+        self.assertEqual(received[0].tag, "custom")
+
+        custom = copy(CustomMessage("test/topic"))
+        self.assertIsInstance(custom, CustomMessage)
+        self.assertEqual(custom.topic, "test/topic")
+        self.assertEqual(custom.extra, "value")
+
+    def test_from_paho_message(self):
+        """Test converting a received paho message."""
+        paho_msg = MQTTMessage(topic=b"test/topic")
+        paho_msg.payload = b"hello"
+        paho_msg.qos = 1
+        props = MqttProperties(PacketTypes.PUBLISH)
+        props.ContentType = "application/json"
+        props.CorrelationData = b"abc"
+        props.UserProperty = [("key", "value")]
+        props.SubscriptionIdentifier = 7
+        paho_msg.properties = props
+
+        msg = Message.from_paho_message(paho_msg)
+        self.assertEqual(msg.topic, "test/topic")
+        self.assertEqual(msg.payload, b"hello")
+        self.assertEqual(msg.qos, 1)
+        self.assertEqual(msg.content_type, "application/json")
+        self.assertEqual(msg.correlation_data, b"abc")
+        self.assertIsNone(msg.response_topic)
+        self.assertEqual(msg.user_properties, {"key": "value"})
+        self.assertEqual(msg.subscription_ids, [7])
+
+    def test_from_paho_message_without_properties(self):
+        """Test converting a received paho message that has no MQTT5 properties."""
+        paho_msg = MQTTMessage(topic=b"test/topic")
+        paho_msg.payload = b"hello"
+
+        msg = Message.from_paho_message(paho_msg)
+        self.assertEqual(msg.topic, "test/topic")
+        self.assertEqual(msg.subscription_ids, [])
+        self.assertEqual(msg.user_properties, {})
+
+
+class TestOnlinePresence(unittest.TestCase):
+    """Test OnlinePresence class."""
+
+    def test_default(self):
+        """Test the default online and offline messages."""
+        presence = OnlinePresence.default("client-1")
+        self.assertEqual(presence.topic, "client/client-1/online")
+        self.assertEqual(presence.online.paho_kwargs()["topic"], "client/client-1/online")
+        self.assertEqual(presence.offline.paho_kwargs()["payload"], b'{"online":false}')
+        with self.assertRaises(AttributeError):
+            presence.topic = "other"
+
+    def test_topic_overrides_message_topics(self):
+        """Test that the presence topic replaces the topic of already published messages."""
+        online = Message(topic="other", payload=b"1", qos=1, retain=True)
+        offline = Message(topic="other", payload=b"0", qos=1, retain=True)
+        online.paho_kwargs()
+
+        presence = OnlinePresence(topic="presence/topic", online=online, offline=offline)
+        self.assertEqual(presence.online.paho_kwargs()["topic"], "presence/topic")
+        self.assertEqual(presence.offline.paho_kwargs()["topic"], "presence/topic")
+
+
+class TestTopicMatcher(unittest.TestCase):
+    """Test TopicMatcher trie."""
+
+    def setUp(self):
+        self.matcher = TopicMatcher()
+        self.matcher.add("test/topic", 1, "exact")
+        self.matcher.add("test/+", 2, "single")
+        self.matcher.add("test/#", 3, "multi")
+        self.matcher.add("#", 4, "all")
+
+    def match(self, topic):
+        return sorted(key for key, _ in self.matcher.iter_match(topic))
+
+    def test_match(self):
+        """Test exact and wildcard filters matching a topic."""
+        self.assertEqual(self.match("test/topic"), [1, 2, 3, 4])
+        self.assertEqual(self.match("test/other"), [2, 3, 4])
+        self.assertEqual(self.match("test/topic/extra"), [3, 4])
+        self.assertEqual(self.match("test"), [3, 4])
+        self.assertEqual(self.match("other"), [4])
+
+    def test_dollar_topics_skip_leading_wildcards(self):
+        """Test that topics starting with '$' are not matched by a leading wildcard."""
+        self.matcher.add("$SYS/#", 5, "sys")
+        self.assertEqual(self.match("$SYS/broker/uptime"), [5])
+
+    def test_remove(self):
+        """Test removing filters."""
+        self.assertEqual(len(self.matcher), 4)
+        self.assertTrue(self.matcher.remove("test/+", 2))
+        self.assertFalse(self.matcher.remove("test/+", 2))
+        self.assertFalse(self.matcher.remove("missing/filter", 1))
+        self.assertEqual(len(self.matcher), 3)
+        self.assertEqual(self.match("test/other"), [3, 4])
+
+    def test_matches(self):
+        """Test matching a single topic filter with the trie's rules."""
+        self.assertTrue(matches("test/topic", "test/topic"))
+        self.assertTrue(matches("test/topic", "test/+"))
+        self.assertTrue(matches("test", "test/#"))
+        self.assertTrue(matches("$SYS/x", "$SYS/#"))
+        self.assertFalse(matches("test/topic/extra", "test/+"))
+        self.assertFalse(matches("$SYS/x", "#"))
+        self.assertFalse(matches("$SYS/x", "+/x"))
+
+
 class TestMqttTransport(unittest.TestCase):
     """Test MqttTransport class."""
 
@@ -214,6 +592,12 @@ class TestMqttTransport(unittest.TestCase):
         self.assertEqual(transport.host_or_path, "ws.example.com")
         self.assertEqual(transport.port, 8080)
 
+    def test_transport_type_values(self):
+        """Test that transport types compare equal to paho's transport names."""
+        self.assertEqual(MqttTransportType.TCP, "tcp")
+        self.assertEqual(MqttTransportType.WEBSOCKET, "websockets")
+        self.assertEqual(MqttTransportType("unix"), MqttTransportType.UNIX)
+
     def test_unix_socket_transport(self):
         """Test Unix socket transport configuration."""
         transport = MqttTransport(
@@ -225,6 +609,165 @@ class TestMqttTransport(unittest.TestCase):
         self.assertEqual(transport.port, 0)
 
 
+def _incoming_message(topic: str, payload: bytes, subscription_id: int) -> MQTTMessage:
+    paho_msg = MQTTMessage(topic=topic.encode())
+    paho_msg.payload = payload
+    props = MqttProperties(PacketTypes.PUBLISH)
+    props.SubscriptionIdentifier = subscription_id
+    paho_msg.properties = props
+    return paho_msg
+
+
+class TestMqtt5Connection(unittest.TestCase):
+    """Test Mqtt5Connection against a stub paho client."""
+
+    def make_connection(self, **kwargs) -> Mqtt5Connection:
+        """Create a connection whose paho client is a stub, already connected, that numbers publishes from 1."""
+        transport = MqttTransport(MqttTransportType.TCP, host="localhost", port=1883)
+        with mock.patch("pyqttier.connection.MqttClient"):
+            conn = Mqtt5Connection(transport, client_id="test-client", **kwargs)
+        mids = itertools.count(1)
+        conn._client.publish.side_effect = lambda *args, **kw: mock.Mock(mid=next(mids))
+        conn._on_connect(conn._client, None, None, 0, None)  # Publishes the online message as mid 1
+        return conn
+
+    def test_last_will_is_offline_message(self):
+        """Test that the offline presence message is registered as the last will."""
+        conn = self.make_connection()
+
+        conn._client.will_set.assert_called_once()
+        will = conn._client.will_set.call_args[1]
+        self.assertEqual(will["topic"], "client/test-client/online")
+        self.assertEqual(will["payload"], b'{"online":false}')
+        self.assertTrue(will["retain"])
+
+    def test_publish_completed_after_tracking(self):
+        """Test a publish that paho reports after its future is tracked."""
+        conn = self.make_connection()
+        fut = conn.publish(Message(topic="test/topic", payload=b"test", qos=1))
+        self.assertFalse(fut.done())
+
+        conn.on_publish_complete(conn._client, None, 2)
+        self.assertTrue(fut.done())
+        self.assertNotIn(2, conn._publish_futures)
+        self.assertNotIn(_PUBLISHED, list(conn._publish_futures.values()))
+
+    def test_publish_completed_before_tracking(self):
+        """Test a publish that paho reports before its future is tracked."""
+        conn = self.make_connection()
+        conn.on_publish_complete(conn._client, None, 2)
+        fut = conn.publish(Message(topic="test/topic", payload=b"test", qos=1))
+
+        self.assertTrue(fut.done())
+        self.assertNotIn(2, conn._publish_futures)
+        self.assertNotIn(_PUBLISHED, list(conn._publish_futures.values()))
+
+    def test_publish_tracked_during_completion(self):
+        """Test a future tracked between the pop and the setdefault of on_publish_complete."""
+        conn = self.make_connection()
+        fut = Future()  # type: Future
+        hooks = [lambda: conn._track_publish(2, fut)]
+
+        class InterleavedDict(dict):
+            def pop(self, *args):
+                result = super().pop(*args)
+                if hooks:
+                    hooks.pop()()
+                return result
+
+        conn._publish_futures = InterleavedDict(conn._publish_futures)
+        conn.on_publish_complete(conn._client, None, 2)
+
+        self.assertEqual(hooks, [])
+        self.assertTrue(fut.done())
+        self.assertNotIn(2, conn._publish_futures)
+        self.assertNotIn(_PUBLISHED, list(conn._publish_futures.values()))
+
+    def test_publish_async_completed_from_another_thread(self):
+        """Test that publish_async resolves when paho reports the publish from its network thread."""
+        conn = self.make_connection()
+
+        async def publish():
+            task = asyncio.ensure_future(conn.publish_async(Message(topic="test/topic", payload=b"test", qos=1)))
+            await asyncio.sleep(0)  # Let publish_async track mid 2
+            self.assertFalse(task.done())
+            threading.Thread(target=conn.on_publish_complete, args=(conn._client, None, 2)).start()
+            await asyncio.wait_for(task, timeout=5)
+
+        asyncio.run(publish())
+        self.assertNotIn(2, conn._publish_futures)
+
+    def test_publish_many_from_generator_that_publishes(self):
+        """Test that publish_many does not hold the connection lock while consuming the caller's iterable."""
+        conn = self.make_connection()
+
+        def messages():
+            conn.publish(Message(topic="test/first", payload=b"test", qos=1))
+            yield Message(topic="test/second", payload=b"test", qos=1)
+
+        worker = threading.Thread(target=conn.publish_many, args=(messages(),), daemon=True)
+        worker.start()
+        worker.join(timeout=5)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(conn._client.publish.call_count, 3)  # The online message and both test messages
+
+    def test_subscription_callbacks_keep_order(self):
+        """Test that messages for one subscription are handled in order on a single worker thread."""
+        conn = self.make_connection(concurrency=4)
+        received = []
+        threads = set()
+        done = threading.Event()
+
+        def callback(msg):
+            received.append(msg.payload)
+            threads.add(threading.current_thread())
+            if len(received) == 20:
+                done.set()
+
+        sub_id = conn.subscribe("test/topic", callback)
+        for i in range(20):
+            conn._on_message(conn._client, None, _incoming_message("test/topic", str(i).encode(), sub_id))
+
+        self.assertTrue(done.wait(timeout=5))
+        self.assertEqual(received, [str(i).encode() for i in range(20)])
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(next(iter(threads)), threading.current_thread())
+
+    def test_dispatch_without_subscription_id(self):
+        """Test that messages without a subscription ID are routed by topic and tagged with the matching subscription."""
+        conn = self.make_connection(concurrency=0)
+        received = []
+        sub_id = conn.subscribe("test/+", lambda msg: received.append(msg))
+        paho_msg = MQTTMessage(topic=b"test/topic")
+        paho_msg.payload = b"test"
+        conn._on_message(conn._client, None, paho_msg)
+
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0].subscription_ids, [sub_id])
+
+    def test_inline_dispatch(self):
+        """Test that callbacks run on the calling thread when concurrency is 0."""
+        conn = self.make_connection(concurrency=0)
+        threads = []
+        sub_id = conn.subscribe("test/topic", lambda msg: threads.append(threading.current_thread()))
+        conn._on_message(conn._client, None, _incoming_message("test/topic", b"test", sub_id))
+
+        self.assertEqual(threads, [threading.current_thread()])
+
+    def test_callback_exception_is_logged(self):
+        """Test that an exception raised by a callback is logged instead of propagated."""
+        conn = self.make_connection(concurrency=0)
+
+        def callback(msg):
+            raise ValueError("boom")
+
+        sub_id = conn.subscribe("test/topic", callback)
+        with self.assertLogs("MqttConnection", level="ERROR") as logs:
+            conn._on_message(conn._client, None, _incoming_message("test/topic", b"test", sub_id))
+
+        self.assertIn("test/topic", logs.output[0])
+
+
 class TestInterface(unittest.TestCase):
     """Test interface compliance."""
 
@@ -236,11 +779,9 @@ class TestInterface(unittest.TestCase):
         self.assertIsInstance(conn, IBrokerConnection)
         
         # Verify all abstract methods are implemented
-        self.assertTrue(callable(getattr(conn, 'publish', None)))
-        self.assertTrue(callable(getattr(conn, 'subscribe', None)))
-        self.assertTrue(callable(getattr(conn, 'add_message_callback', None)))
-        self.assertTrue(callable(getattr(conn, 'is_topic_sub', None)))
-        self.assertTrue(callable(getattr(conn, 'is_connected', None)))
+        self.assertEqual(MockConnection.__abstractmethods__, frozenset())
+        for name in IBrokerConnection.__abstractmethods__:
+            self.assertIsNot(getattr(MockConnection, name), getattr(IBrokerConnection, name), name)
 
     def test_unpublish_retained(self):
         """Test the unpublish_retained helper method."""